@@ -1,9 +1,11 @@
 # Caches pickled python objects to disk
 # If the source file is newer than the cache file, the cache is considered invalid
+# unless the content hash of the sources stored next to the cache file still matches.
 
-import os, shutil
-from typing import Callable, Protocol
+import os, shutil, hashlib, mmap
+from typing import Callable, Iterable, Protocol
 
+# Not marshal: every cached root (Codebase, access results) is a class instance, which marshal rejects
 import pickle
 
 from .internal import *
@@ -13,6 +15,78 @@ cachedir = "build/.parsecache"  # Relative to workspace.rootPath
 
 use_cache = True
 
+_io_buffer_size = 1 << 20  # Read and write cache files in large chunks
+
+# path -> st_mtime, collected in bulk by prime_stat_cache()
+_mtime_cache: dict[str, float] = {}
+
+def _mtime(path: str) -> float:
+    if (mtime := _mtime_cache.get(path)) is not None:
+        return mtime
+    return os.stat(path).st_mtime
+
+def _scan_mtimes(dirpath: str) -> None:
+    try:
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    _scan_mtimes(entry.path)
+                else:
+                    _mtime_cache[entry.path] = entry.stat().st_mtime
+    except FileNotFoundError:
+        pass
+
+def prime_stat_cache(files: Iterable[str] = ()) -> None:
+    """Collect mtimes of all cache files and of the given source files in one pass
+    so that is_cached() doesn't need to stat them one by one."""
+    _mtime_cache.clear()
+    if workspace.rootPath:
+        _scan_mtimes(getcachedir())
+    for fname in files:
+        try:
+            _mtime_cache[fname] = os.stat(fname).st_mtime
+        except FileNotFoundError:
+            pass
+
+# path -> ((mtime_ns, size), digest) to avoid rehashing unchanged files
+_hash_cache: dict[str, tuple[tuple[int, int], bytes]] = {}
+
+def _file_hash(path: str) -> bytes:
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    if (hashed := _hash_cache.get(path)) is not None and hashed[0] == key:
+        return hashed[1]
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb", buffering=0) as f:
+        while chunk := f.read(_io_buffer_size):
+            h.update(chunk)
+    _hash_cache[path] = (key, h.digest())
+    return _hash_cache[path][1]
+
+# Combined content hash of the source file or of all dependencies
+def _sources_hash(srcpath: str, dependencies: list[str] | None = None) -> bytes:
+    h = hashlib.blake2b(digest_size=16)
+    for path in (dependencies or (srcpath,)):
+        h.update(_file_hash(path))
+    return h.digest()
+
+def _metapath(cachepath: str) -> str:
+    return cachepath + ".meta"
+
+def _is_hash_match(cachepath: str, srcpath: str, dependencies: list[str] | None = None) -> bool:
+    try:
+        with open(_metapath(cachepath), "rb") as f:
+            if f.read() != _sources_hash(srcpath, dependencies):
+                return False
+    except FileNotFoundError:
+        return False
+    try:
+        os.utime(cachepath)  # Content is the same: make the fast mtime check pass next time
+    except OSError:
+        pass  # E.g. a read-only shared cache, the content check will run again
+    _mtime_cache.pop(cachepath, None)
+    return True
+
 def getcachedir() -> str:
     return os.path.join(workspace.rootPath, cachedir)
 
@@ -22,6 +96,7 @@ def clearcache():
     cachepath = getcachedir()
     if os.path.exists(cachepath):
         shutil.rmtree(cachepath)
+    _mtime_cache.clear()
 
 def relpath(srcpath: str) -> str:
     return (os.path.relpath(srcpath, workspace.rootPath)
@@ -45,14 +120,11 @@ def is_cached(srcpath: str,
     if not cachepath:
         return False
     try:
-        cachestat = os.stat(cachepath)
-        if not dependencies:
-            srcstat = os.stat(srcpath)
-            return (srcstat.st_mtime - cachestat.st_mtime) <= 1
-        for dep in dependencies:
-            depstat = os.stat(dep)
-            if (depstat.st_mtime - cachestat.st_mtime) > 1:
-                return False
+        cache_mtime = _mtime(cachepath)
+        for dep in (dependencies or (srcpath,)):
+            # Sources that are newer or too close to the cache write to tell are compared by content
+            if _mtime(dep) > cache_mtime - 1:
+                return _is_hash_match(cachepath, srcpath, dependencies)
         return True
     except FileNotFoundError:
         return False
@@ -67,20 +139,36 @@ def get(srcpath: str,
     if not is_cached(srcpath, dependencies, suffix=suffix, cachepath=cachepath):
         return None
     try:
-        with open(cachepath, "rb") as f:
-            return pickle.load(f)
-    except (FileNotFoundError, pickle.UnpicklingError):
+        # Deserialize straight from the page cache without reading the file into memory first
+        with open(cachepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return pickle.loads(mm)
+    except (FileNotFoundError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
         return None
 
-# Pickles the object to the cache
-def put(obj: object, srcpath: str, suffix: str = "", cachepath: str = "") -> object:
+# Serializes the object to the cache along with the content hash of its sources
+def put(obj: object, srcpath: str,
+        dependencies: list[str] | None = None,
+        suffix: str = "",
+        cachepath: str = "") -> object:
     if not cachepath:
         cachepath = getcachepath(srcpath, suffix)
     if not cachepath:
         return obj
     os.makedirs(os.path.dirname(cachepath), exist_ok=True)
-    with open(cachepath, "wb") as f:
-        pickle.dump(obj, f)
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        os.unlink(_metapath(cachepath))  # Must not validate the new data if hashing fails below
+    except FileNotFoundError:
+        pass
+    with open(cachepath, "wb", buffering=_io_buffer_size) as f:
+        f.write(data)
+    _mtime_cache.pop(cachepath, None)
+    try:
+        srchash = _sources_hash(srcpath, dependencies)
+    except FileNotFoundError:
+        return obj
+    with open(_metapath(cachepath), "wb") as f:
+        f.write(srchash)
     return obj
 
 # Decorator that wraps a function or instance method with caching
@@ -101,7 +189,7 @@ def cached(file: Callable[..., str] | str = "",
             suffix_ = suffixFn(*args, **kwargs)
             if (obj := get(key_, dependencies=deps_, suffix=suffix_)) is not None:
                 return obj
-            return put(func(*args, **kwargs), key_, suffix=suffix_)
+            return put(func(*args, **kwargs), key_, dependencies=deps_, suffix=suffix_)
         return wrapper
     return decorator
 
@@ -1,5 +1,5 @@
 import regex
-import multiprocessing, signal
+import sys, multiprocessing, signal
 from dataclasses import dataclass, field
 from typing import Iterable, Any
 
@@ -13,7 +13,7 @@ from . import workspace
 
 Details: TypeAlias = FunctionParts | RecordParts | Variable | MacroParts
 
-@dataclass
+@dataclass(slots=True)
 class Definition:
     name: str
     kind: str
@@ -25,6 +25,18 @@ class Definition:
     preComments: list[Token] = field(default_factory=list)
     postComments: list[Token] = field(default_factory=list)
 
+    def __post_init__(self):
+        # The same names repeat across files and modules across all definitions
+        self.name = sys.intern(self.name)
+        self.module = sys.intern(self.module)
+
+    def __setstate__(self, state):
+        # Unpickling (cache, worker results) restores the slots without __post_init__
+        _, slots = state
+        for name, value in slots.items():
+            setattr(self, name, value)
+        self.__post_init__()
+
     def short_repr(self) -> str:
         return (
             f"{self.name} ({self.kind}) {self.scope.locationStr(self.offset)} [{self.module}] " +
@@ -63,11 +75,12 @@ class Definition:
             self.is_private = True
         elif self.is_private is None and other.is_private is not None:
             self.is_private = other.is_private
-        if type(self.details).__name__ != type(other.details).__name__:
+        details_type = type(self.details)
+        if details_type is not type(other.details):
             Log.defn_conflict(self.locationStr, f"conflicting update for details type:")
             Log.defn_conflict(other.locationStr, f"conflict here:")
             LOG(Log.defn_conflict.level, f"details type mismatch for '{self.name}': "
-                    f"{type(self.details)} != {type(other.details)}\n"
+                    f"{details_type} != {type(other.details)}\n"
                     f"{self.short_repr()}\n{other.short_repr()}")
         else:
             if self.details is not None:
@@ -78,15 +91,26 @@ class Definition:
                     LOG_ERROR_FUNC(other.locationStr, f"conflict here:")
                     for error in errors:
                         LOG_ERROR_FUNC(None, error)
-        self.preComments += other.preComments
-        self.postComments += other.postComments
+        self.preComments.extend(other.preComments)
+        self.postComments.extend(other.postComments)
 
 
 def _dict_upsert_def(d: dict[str, Definition], other: Definition) -> None:
-    if other.name in d:
-        d[other.name].update(other)
-    else:
-        d[other.name] = other
+    if (defn := d.setdefault(other.name, other)) is not other:
+        defn.update(other)
+
+_reg_visibility_comment = regex.compile(r"\#(?>(public)|(private))\b(?>\((\w++)\))?", re_flags)
+
+# Compiled for the current workspace.moduleSrcNames which are replaced by setModules()
+_reg_module_name: tuple[set[str], regex.Pattern] | None = None
+
+def _get_reg_module_name() -> regex.Pattern:
+    global _reg_module_name
+    if _reg_module_name is None or _reg_module_name[0] is not workspace.moduleSrcNames:
+        _reg_module_name = (workspace.moduleSrcNames,
+                            regex.compile(r"^(?>(__wt_)|(__wti_|WT_))(?>(\L<names>)_)?",
+                                          re_flags, names=workspace.moduleSrcNames))
+    return _reg_module_name[1]
 
 def _get_visibility_and_module(thing: Details, default_private: bool | None = None,
                                default_module: str = "",
@@ -95,17 +119,16 @@ def _get_visibility_and_module(thing: Details, default_private: bool | None = No
         If is_private is None -> privacy not specified -> public.
         NOTE: The name can only include one module name is it's not top-level.
     """
-    if thing.preComment is not None:
-        if match := regex.search(r"\#(?>(public)|(private))\b(?>\((\w++)\))?",
-                                 thing.preComment.value, flags=re_flags):
+    # Most comments and names have no annotations: check substrings before running the regexes
+    if thing.preComment is not None and "#p" in thing.preComment.value:
+        if match := _reg_visibility_comment.search(thing.preComment.value):
             return (bool(match[2]), match[3] if match[3] else default_module)
-    if thing.postComment is not None:
-        if match := regex.search(r"\#(?>(public)|(private))\b(?>\((\w++)\))?",
-                                 thing.postComment.value, flags=re_flags):
+    if thing.postComment is not None and "#p" in thing.postComment.value:
+        if match := _reg_visibility_comment.search(thing.postComment.value):
             return (bool(match[2]), match[3] if match[3] else default_module)
 
-    match = regex.match(r"^(?>(__wt_)|(__wti_|WT_))(?>(\L<names>)_)?",
-                        thing.name.value, flags=re_flags, names=workspace.moduleSrcNames)
+    match = _get_reg_module_name().match(thing.name.value) \
+                if thing.name.value.startswith(("__wt_", "__wti_", "WT_")) else None
     module_from_name = (workspace.moduleAliasesSrc.get(match[3], match[3])
                         if match and match[3] else default_module)
 
@@ -138,7 +161,7 @@ def _get_visibility_and_module_check(thing: Details,
               f"Assigning it to module [{ret[1]}].")
     return ret
 
-@dataclass
+@dataclass(slots=True)
 class Codebase:
     # Records: structs, unions, enums
     types: dict[str, Definition] = field(default_factory=dict)
@@ -154,6 +177,8 @@ class Codebase:
     typedefs: dict[str, str] = field(default_factory=dict)
     typedefs_merged: bool = field(default=False, repr=False)
     alltypes: frozenset[str] = field(default_factory=frozenset, repr=False)
+    # (record_name, field_name) -> un-typedefed field type, filled in once typedefs are merged
+    field_types: dict[tuple[str, str], str] = field(default_factory=dict, repr=False)
     # Macros
     macros: dict[str, Definition] = field(default_factory=dict)
     # macros_restricted: dict[str, Definition] = field(default_factory=dict)
@@ -226,18 +251,25 @@ class Codebase:
 
     # Get the un-typedefed type of a field or ""
     def get_field_type(self, rec_type: str, field_name: str) -> str:
+        if (ret := self.field_types.get((rec_type, field_name))) is not None:
+            return ret
         if not rec_type in self.fields or \
                 field_name not in self.fields[rec_type] or \
                 not self.fields[rec_type][field_name] or \
                 not self.fields[rec_type][field_name].details or \
                 not cast(Details, self.fields[rec_type][field_name].details).typename:
-            return ""  # unknown type
-        return self.untypedef(get_base_type(
-            cast(Details, self.fields[rec_type][field_name].details).typename))
+            ret = ""  # unknown type
+        else:
+            ret = self.untypedef(get_base_type(
+                cast(Details, self.fields[rec_type][field_name].details).typename))
+        if self.typedefs_merged:  # Resolution is final only after typedefs are merged
+            self.field_types[(rec_type, field_name)] = ret
+        return ret
 
     def addRecordDesc(self, record: RecordParts | None, is_global_scope: bool = True) -> None:
         if record is None:
             return
+        self.field_types.clear()
         record.getMembers()
         is_nested = bool(record.parent)
         default_private, default_module = scope_file().is_private, scope_module()
@@ -265,7 +297,7 @@ class Codebase:
                     record, default_private=scope_file().is_private, default_module=scope_module(),
                     is_nested=True)
                 if record.name.value not in self.fields:
-                    self.fields[record.name.value] = {}
+                    self.fields[sys.intern(record.name.value)] = {}
                 _dict_upsert_def(self.fields[record.name.value], Definition(
                     name=member.name.value,
                     kind="field",
@@ -276,7 +308,7 @@ class Codebase:
                     details=member))
         if record.typedefs:
             for typedef in record.typedefs:
-                self.typedefs[typedef.name.value] = record.name.value
+                self.typedefs[sys.intern(typedef.name.value)] = sys.intern(record.name.value)
         if record.vardefs:
             if is_global_scope:
                 Log.ignored_global(scope().locationStr(record.name.range[0]),
@@ -317,7 +349,8 @@ class Codebase:
                         if not var.typename:
                             var.typename = saved_type
                         if var.typename:
-                            self.typedefs[var.name.value] = get_base_type(var.typename)
+                            self.typedefs[sys.intern(var.name.value)] = \
+                                sys.intern(get_base_type(var.typename))
                             DEBUG3(lambda: scope().locationStr(st.range()[0]),
                                    lambda: f"Typedef: {var.name.value} = {var.typename} = "
                                            f"{self.typedefs[var.name.value]}")
@@ -395,7 +428,9 @@ class Codebase:
         with ScopePush(file=File(fname)):
             self.updateMacroFromText(scope_file().read())
 
-    def scanFiles(self, files: Iterable[str], twopass = True, multithread = True) -> None:
+    def scanFiles(self, files: Iterable[str], twopass = True, multithread = True,
+                  jobs: int | None = None) -> None:
+        files = list(files)
         if twopass:
             for fname in files:
                 # if get_file_priority(fname) <= 1:
@@ -406,12 +441,13 @@ class Codebase:
                     self.updateFromFile(fname, expand_preproc=True)
             else:
                 init_multithreading()
-                with multiprocessing.Pool(processes=multiprocessing.cpu_count(),
-                                          initializer=signal.signal,
-                                          initargs=(signal.SIGINT, signal.SIG_IGN)) as pool:
-                    for res in pool.starmap(
-                                Codebase._preprocess_file_for_multi,
-                                ((self, fname) for fname in files)):
+                jobs = jobs or multiprocessing.cpu_count()
+                # The codebase goes to the workers once via fork rather than pickled with each file
+                with multiprocessing.Pool(processes=jobs,
+                                          initializer=_init_multi_worker,
+                                          initargs=(self,)) as pool:
+                    for res in pool.imap(_preprocess_file_in_worker, files,
+                                         chunksize=max(1, len(files) // (jobs * 4))):
                         self._update_from_multi(*res)
         else:
             for fname in files:
@@ -430,15 +466,16 @@ class Codebase:
                 self.typedefs[k] = v
             for dst, src in ((self.types, types),
                                 (self.names, names)):
-                for name in src:
-                    _dict_upsert_def(dst, src[name])
+                for defn in src.values():
+                    _dict_upsert_def(dst, defn)
             for dst2, src2 in ((self.fields, fields),
                                 (self.static_names, static_names)):
-                for name2 in src2:
+                for name2, src in src2.items():
                     if name2 not in dst2:
-                        dst2[name2] = {}
-                    for name in src2[name2]:
-                        _dict_upsert_def(dst2[name2], src2[name2][name])
+                        dst2[name2] = src  # Nothing to merge with, take the worker's dict as is
+                        continue
+                    for defn in src.values():
+                        _dict_upsert_def(dst2[name2], defn)
 
     @staticmethod
     def _preprocess_file_for_multi(self: 'Codebase', fname: str) -> tuple[str, str,
@@ -456,3 +493,21 @@ class Codebase:
                 self.updateFromText(txt, do_preproc=False)
             errors = workspace.logStream.getvalue() # type: ignore # logStream is a StringIO
         return (fname, errors, self.types, self.fields, self.names, self.static_names, self.typedefs)
+
+# The codebase being scanned, in a worker process
+_multi_codebase: Codebase | None = None
+
+def _init_multi_worker(codebase: Codebase) -> None:
+    global _multi_codebase
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _multi_codebase = codebase
+
+def _preprocess_file_in_worker(fname: str) -> tuple[str, str,
+                dict[str, Definition],
+                dict[str, dict[str, Definition]],
+                dict[str, Definition],
+                dict[str, dict[str, Definition]],
+                dict[str, str]]:
+    # Only return what was found in this file: start from an empty codebase with the same macros
+    return Codebase._preprocess_file_for_multi(
+        Codebase(macros=_multi_codebase.macros), fname)  # type: ignore[union-attr] # set by _init_multi_worker
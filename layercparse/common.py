@@ -26,9 +26,18 @@ reg_clean = regex.compile(re_clean, re_flags)
 
 reg_cr = regex.compile(r"""[^\n]""", re_flags)
 
+# Same as re_clean but strings are skipped rather than matched, so that every match is
+# a comment or a preprocessor directive and no callback is needed to tell them apart.
+re_clean_skip = r'''
+    (?> (?> " (?>[^\\"]|\\.)* " ) | (?> ' (?>[^\\']|\\.)* ' ) ) (*SKIP)(*FAIL) |
+    (?>(?> (?:\#|\/\/) (?:[^\\\n]|\\.)*+ \n) |
+    (?> \/\* (?:[^*]|\*[^\/])*+ \*\/ ))++
+''' # /nxs;
+reg_clean_skip = regex.compile(re_clean_skip, re_flags)
+
 # Remove comments and preprocessor directives, preserving newlines and text size
 def clean_text_sz(txt: str):
-    return reg_clean.sub(lambda match: reg_cr.sub(" ", match[0]) if match["s"] else match[0], txt)
+    return reg_clean_skip.sub(lambda match: reg_cr.sub(" ", match[0]), txt)
 
 # Remove comments, preprocessor directives and strings, preserving newlines and text size
 def clean_text_more_sz(txt: str):
@@ -36,7 +45,7 @@ def clean_text_more_sz(txt: str):
 
 # Remove comments and preprocessor directives
 def clean_text(txt: str):
-    return reg_clean.sub(lambda match: " " if match["s"] else match[0], txt)
+    return reg_clean_skip.sub(" ", txt)
 
 re_clean2 = r'''(
     (?P<s>(?>\s++ |
@@ -47,6 +56,14 @@ re_clean2 = r'''(
 )''' # /nxs;
 reg_clean2 = regex.compile(re_clean2, re_flags)
 
+re_clean2_skip = r'''
+    (?> (?> " (?>[^\\"]|\\.)* " ) | (?> ' (?>[^\\']|\\.)* ' ) ) (*SKIP)(*FAIL) |
+    (?>\s++ |
+    (?> (?:\#|\/\/) (?:[^\\\n]|\\.)*+ \n) |
+    (?> \/\* (?:[^*]|\*[^\/])*+ \*\/ ))++
+''' # /nxs;
+reg_clean2_skip = regex.compile(re_clean2_skip, re_flags)
+
 # Remove comments and preprocessor directives and compact spaces
 def clean_text_compact(txt: str):
-    return reg_clean2.sub(lambda match: " " if match["s"] else match[0], txt)
+    return reg_clean2_skip.sub(" ", txt)
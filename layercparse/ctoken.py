@@ -1,7 +1,10 @@
 import enum
+import itertools
+import os
+import multiprocessing, signal
 import regex
 from dataclasses import dataclass, field
-from typing import Iterable
+from typing import Iterable, Iterator
 
 from . import common
 from .internal import *
@@ -21,22 +24,29 @@ TokenKind: TypeAlias = Literal[
         ";",  # end of expression: , or ;
         "@"]  # invalid thing
 
+# Kinds that are fully determined by the first character
+_kind_by_first_char: dict[str, TokenKind] = {
+    " ": " ", "\t": " ", "\n": " ", "\r": " ",
+    "'": "'", '"': "'",
+    "(": "(", "{": "{", "[": "[", "#": "#",
+}
+_c_ops = frozenset(c_ops_all)
+
 def getTokenKind(txt: str) -> TokenKind:
+    if (kind := _kind_by_first_char.get(txt[:1])) is not None:
+        return kind
     return \
-        " " if txt.startswith((" ", "\t", "\n", "\r")) else \
         "/" if txt.startswith(("//", "/*")) else \
-        "'" if txt.startswith(("'", '"')) else \
-        "(" if txt.startswith("(") else \
-        "{" if txt.startswith("{") else \
-        "[" if txt.startswith("[") else \
-        "#" if txt.startswith("#") else \
-        ";" if txt in [",", ";"] else \
-        "+" if txt in c_ops_all else \
+        ";" if txt in (",", ";") else \
+        "+" if txt in _c_ops else \
         "w" if reg_word_char.match(txt) else \
         "@" if txt.startswith("@") else \
         ""
 
-@dataclass
+# Kinds of tokens that are not code: spaces, preprocessor, comments, separators
+_kinds_non_code: frozenset[TokenKind] = frozenset((" ", "#", "/", ";"))
+
+@dataclass(slots=True)
 class Token:
     """One token in the source code"""
     idx: int = field(compare=False)     # Index in the original stream of tokens
@@ -44,6 +54,14 @@ class Token:
     value: str                          # Text value
     kind: TokenKind | None = field(default=None, repr=False)
 
+    def __eq__(self, other: object) -> bool:
+        # Same fields as the generated one, without building tuples, and the same object is equal
+        if self is other:
+            return True
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.value == other.value and self.kind == other.kind  # type: ignore[attr-defined]
+
     def getKind(self) -> TokenKind:
         if self.kind is not None:
             return self.kind
@@ -82,61 +100,137 @@ class TokenList(list[Token]):
             i += 1
     @staticmethod
     def xFromText(txt: str, base_offset: int, **kwargs) -> Iterable[Token]:
-        i = 0
-        for match in reg_token.finditer(txt, **kwargs):
-            yield Token.fromMatch(match, base_offset=base_offset, idx=i)
-            i += 1
+        # Inlined Token.fromMatch: this runs for every token of every file
+        for i, match in enumerate(reg_token.finditer(txt, **kwargs)):
+            start, end = match.span()
+            yield Token(i, (start + base_offset, end + base_offset), match[0])
     @staticmethod
     def fromText(txt: str, base_offset: int, **kwargs) -> 'TokenList':
-        return TokenList(TokenList.xFromText(txt, base_offset=base_offset, **kwargs))
+        # Same as xFromText but without the generator round-trip per token
+        return TokenList([Token(i, (match.start() + base_offset, match.end() + base_offset), match[0])
+                          for i, match in enumerate(reg_token.finditer(txt, **kwargs))])
+
+    @staticmethod
+    def xFromTextCode(txt: str, base_offset: int, **kwargs) -> Iterable[Token]:
+        """Same as xxFilterCode(xFromText(...)) without constructing the skipped tokens"""
+        for i, match in enumerate(reg_token.finditer(txt, **kwargs)):
+            if (kind := getTokenKind(match[0])) not in _kinds_non_code:
+                start, end = match.span()
+                yield Token(i, (start + base_offset, end + base_offset), match[0], kind)
+    @staticmethod
+    def fromTextCode(txt: str, base_offset: int, **kwargs) -> 'TokenList':
+        return TokenList(TokenList.xFromTextCode(txt, base_offset=base_offset, **kwargs))
 
     @staticmethod
     def xFromFile(fname: str, **kwargs) -> Iterable[Token]:
-        with open(fname) as file:
-            return TokenList.xFromText(file.read(), base_offset=0, **kwargs)
+        return TokenList.xFromText(file_content(fname), base_offset=0, **kwargs)
     @staticmethod
     def fromFile(fname: str, **kwargs) -> 'TokenList':
-        return TokenList(TokenList.xFromFile(fname, **kwargs))
+        st = os.stat(fname)
+        key = (st.st_mtime_ns, st.st_size, tuple(kwargs.items()))
+        if (cached := _file_tokens.pop(fname, None)) is None or cached[0] != key:
+            cached = (key, tuple(TokenList.xFromFile(fname, **kwargs)))
+        _file_tokens[fname] = cached  # Most recently used goes last
+        if len(_file_tokens) > _file_tokens_max:
+            del _file_tokens[next(iter(_file_tokens))]
+        # Fresh tokens since callers may modify both the list and the tokens
+        return TokenList([Token(t.idx, t.range, t.value, t.kind) for t in cached[1]])
+
+    @staticmethod
+    def evict(fname: str) -> None:
+        """Drop the remembered tokens of the file so the next fromFile() reads it again"""
+        _file_tokens.pop(fname, None)
+
+    @staticmethod
+    def xFromFiles(fnames: Iterable[str], multithread: bool = True,
+                   jobs: int | None = None) -> Iterable[tuple[str, 'TokenList']]:
+        """Tokenize many files, in worker processes if multithread. Yields (fname, tokens) in order."""
+        fnames = list(fnames)
+        if not multithread or len(fnames) < 2:
+            for fname in fnames:
+                yield (fname, TokenList.fromFile(fname))
+            return
+        init_multithreading()
+        jobs = jobs or multiprocessing.cpu_count()
+        with multiprocessing.Pool(processes=jobs,
+                                  initializer=signal.signal,
+                                  initargs=(signal.SIGINT, signal.SIG_IGN)) as pool:
+            yield from zip(fnames, pool.imap(TokenList.fromFile, fnames,
+                                             chunksize=max(1, len(fnames) // (jobs * 4))))
+    @staticmethod
+    def fromFiles(fnames: Iterable[str], multithread: bool = True,
+                  jobs: int | None = None) -> dict[str, 'TokenList']:
+        return dict(TokenList.xFromFiles(fnames, multithread=multithread, jobs=jobs))
 
     def __str__(self) -> str:
-        return f"[{self.range()[0]}:{self.range()[1]}] 〈{'⌇'.join(self.strings())}〉"
+        return self.__repr__()
     def __repr__(self) -> str:
-        return f"[{self.range()[0]}:{self.range()[1]}] 〈{'⌇'.join(self.strings())}〉"
+        begin, end = self.range()
+        return f"[{begin}:{end}] 〈{'⌇'.join([t.value for t in self])}〉"
 
     @staticmethod
     def xxFilterCode(tokens: Iterable[Token]) -> Iterable[Token]:
         for t in tokens:
-            if t.getKind() not in [" ", "#", "/", ";"]:
+            if t.getKind() not in _kinds_non_code:
                 yield t
     def xFilterCode(self) -> Iterable[Token]:
         return TokenList.xxFilterCode(self)
     def filterCode(self) -> 'TokenList':
-        return TokenList(self.xFilterCode())
+        return TokenList([t for t in self if t.getKind() not in _kinds_non_code])
 
     def xFilterCode_r(self) -> Iterable[Token]:
         for t in reversed(self):
-            if t.getKind() not in [" ", "#", "/", ";"]:
+            if t.getKind() not in _kinds_non_code:
                 yield t
     def filterCode_r(self) -> 'TokenList':
-        return TokenList(self.xFilterCode_r())
-
+        return TokenList([t for t in reversed(self) if t.getKind() not in _kinds_non_code])
+
+
+class TokenStream:
+    """Tokens indexed like a list but pulled from a generator on demand,
+    so that a consumer that stops early doesn't tokenize the rest of the text."""
+    def __init__(self, tokens: Iterable[Token]):
+        self._source = iter(tokens)
+        self._tokens: list[Token] = []
+
+    def __getitem__(self, i: int) -> Token:
+        tokens = self._tokens
+        while i >= len(tokens):
+            try:
+                tokens.append(next(self._source))
+            except StopIteration:
+                raise IndexError(i) from None
+        return tokens[i]
+
+    def __iter__(self) -> Iterator[Token]:
+        for i in itertools.count():
+            try:
+                yield self[i]
+            except IndexError:
+                return
+
+# fname -> ((mtime_ns, size, kwargs), tokens) of recently read files, least recently used first.
+# A changed file doesn't match by its mtime and size and is read again.
+_file_tokens: dict[str, tuple[tuple[int, int, tuple], tuple[Token, ...]]] = {}
+_file_tokens_max = 512
 
 def get_pre_comment(tokens: TokenList) -> tuple[Token | None, int]:
-    for i in range(len(tokens)):
-        token = tokens[i]
-        if token.getKind() == " ":
+    for i, token in enumerate(tokens):
+        kind = token.getKind()
+        if kind == " ":
             continue
-        if token.getKind() == "/":
+        if kind == "/":
             return (token, i+1)
         return (None, i)
-    return (None, i+1)
+    return (None, len(tokens))
 
 
 def get_post_comment(tokens: TokenList) -> Token | None:
     for token in reversed(tokens):
-        if token.getKind() == " ":
+        kind = token.getKind()
+        if kind == " ":
             continue
-        if token.getKind() == "/":
+        if kind == "/":
             return token
         return None
     return None
@@ -58,7 +58,7 @@ class FunctionParts:
         preComment, _ = get_pre_comment(statement.tokens)
         postComment = get_post_comment(statement.tokens)
 
-        clean_tokens = clean_tokens_decl(statement.tokens.filterCode(), clean_static_const=False)
+        clean_tokens = clean_tokens_decl(statement.tokens.xFilterCode(), clean_static_const=False)
 
         retType, i, name = scan_defn_ctype(clean_tokens, ignore_static_const=False)
         if not retType or i >= len(clean_tokens) or name:  # having name means it's not a function
@@ -75,36 +75,37 @@ class FunctionParts:
         else:
             return None
 
+        # Kinds are looked up once so that searching for () and {} is done by list.index
+        kinds = [t.getKind() for t in clean_tokens]
+
         # It must be () and the last word of type is the function name
         token = clean_tokens[i]
-        if token.getKind() == "w":
+        if kinds[i] == "w":
             name = token
             # Find a ()
-            for i in range(i+1, len(clean_tokens)):
-                token = clean_tokens[i]
-                if token.getKind() == "(":
-                    break
-            else:
+            try:
+                i = kinds.index("(", i+1)
+            except ValueError:
                 return None
-        elif token.getKind() != "(":
+            token = clean_tokens[i]
+        elif kinds[i] != "(":
             return None
 
         # It's a ().
         # Now find out if it's an arguments list or a function pointer
         argsList = Token(token.idx, (token.range[0]+1, token.range[1]-1), token.value[1:-1])
 
-        body: Token | None = None
+        body_idx = -1  # The body is sliced out once its final position is known
         if not name:
             # If there are more ()s at this level, it's a function pointer and args are somewhere else
             for i in range(i+1, len(clean_tokens)):
                 token = clean_tokens[i]
-                if token.getKind() == "(":
+                if kinds[i] == "(":
                     # Found another (), so the first one was a function pointer and this is the args
                     for token in reversed(
                             clean_tokens_decl(
-                                TokenList(TokenList.xxFilterCode(
-                                    TokenList.xFromText(
-                                        argsList.value, base_offset=argsList.range[0]))))):
+                                TokenList.xFromTextCode(
+                                    argsList.value, base_offset=argsList.range[0]))):
                         if token.getKind() == "w":
                             name = token
                             break
@@ -112,32 +113,32 @@ class FunctionParts:
                         name = Token.empty()
                     argsList = Token(token.idx, (token.range[0]+1, token.range[1]-1), token.value[1:-1])
                     break
-                if token.getKind() == "{":
-                    body = Token(token.idx, (token.range[0]+1, token.range[1]-1), token.value[1:-1])
+                if kinds[i] == "{":
+                    body_idx = i
             else: # not break
                 # The name is the last word of the type
                 name = retType.pop()
 
         # Finish scanning if there's no body
-        if not body:
-            for i in range(i+1, len(clean_tokens)):
-                token = clean_tokens[i]
-                if token.getKind() == "{":
-                    body = Token(token.idx, (token.range[0]+1, token.range[1]-1), token.value[1:-1])
-                    break
+        if body_idx < 0:
+            try:
+                body_idx = kinds.index("{", i+1)
+            except ValueError:
+                pass
+        body: Token | None = None
+        if body_idx >= 0:
+            token = clean_tokens[body_idx]
+            body = Token(token.idx, (token.range[0]+1, token.range[1]-1), token.value[1:-1])
 
         is_type_const, is_type_static = False, False
-        i = 0
-        while i < len(retType):
-            match retType[i].value:
+        for token in retType:
+            match token.value:
                 case "const":
                     is_type_const = True
-                    retType.pop(i)
                 case "static":
                     is_type_static = True
-                    retType.pop(i)
-                case _:
-                    i += 1
+        if is_type_const or is_type_static:
+            retType = TokenList([token for token in retType if token.value not in ("const", "static")])
 
         return FunctionParts(retType,
                              name, # type: ignore[arg-type] # name is guaranteed to be a Token
@@ -148,10 +149,17 @@ class FunctionParts:
                              is_type_const=is_type_const, is_type_static=is_type_static)
 
     def xGetArgs(self) -> Iterable[Variable]:
-        for stt in StatementList.xFromText(self.args.value, base_offset=self.args.range[0]):
-            var = Variable.fromFuncArg(stt.tokens)
-            if var:
+        # Arguments are separated by top-level commas, no need for full statement splitting
+        arg = TokenList()
+        for token in TokenList.xFromText(self.args.value, base_offset=self.args.range[0]):
+            if token.value != ",":
+                arg.append(token)
+                continue
+            if var := Variable.fromFuncArg(arg):
                 yield var
+            arg = TokenList()
+        if var := Variable.fromFuncArg(arg):
+            yield var
     def getArgs(self) -> list[Variable]:
         return list(self.xGetArgs())
 
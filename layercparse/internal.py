@@ -4,6 +4,7 @@ from dataclasses import dataclass
 from typing import Union, Any, Optional, TYPE_CHECKING, cast, Iterator, TypeAlias
 from typing import Generator, Iterable, Callable, NamedTuple, TypedDict, Literal
 import regex
+import mmap, locale
 
 # This regex parses C code into fat tokens.
 # Fat token is a highlevel thing like a string, a comment, a block, etc.
@@ -70,13 +71,13 @@ reg_identifier = regex.compile(r"^[a-zA-Z_]\w++$", re_flags)
 # Regex to match a C type definition.
 reg_type = regex.compile(r"^[\w\[\]\(\)\*\, ]++$", re_flags)
 
-c_type_keywords = ["const", "volatile", "restrict", "static", "extern", "auto",
-                   "register", "struct", "union", "enum"]
+c_type_keywords = frozenset(["const", "volatile", "restrict", "static", "extern", "auto",
+                             "register", "struct", "union", "enum"])
 c_statement_keywords = ["case", "continue", "default", "do", "else", "for", "goto", "if",
                         "return", "switch", "while" ]
 reg_statement_keyword = regex.compile(r"^(?:" + "|".join(c_statement_keywords) + r")$", re_flags)
 
-c_types = ["void", "char", "short", "int", "long", "float", "double", "signed", "unsigned", "bool",
+c_types = frozenset(["void", "char", "short", "int", "long", "float", "double", "signed", "unsigned", "bool",
            "size_t", "ssize_t", "ptrdiff_t", "intptr_t", "uintptr_t", "int8_t", "int16_t",
            "int32_t", "int64_t", "uint8_t", "uint16_t", "uint32_t", "uint64_t", "int_least8_t",
            "int_least16_t", "int_least32_t", "int_least64_t", "uint_least8_t", "uint_least16_t",
@@ -87,8 +88,8 @@ c_types = ["void", "char", "short", "int", "long", "float", "double", "signed",
            "__int64", "__uint64", "__int32", "__uint32", "__int16", "__uint16", "__int8",
            "__uint8",
            "timespec", "timeval", "tm", "FILE", "DIR", "pid_t", "uid_t", "gid_t", "mode_t",
-           ]
-ignore_type_keywords = [
+           ])
+ignore_type_keywords = frozenset([
     "inline", "restrict", "volatile", "auto", "register",
     "__attribute__", "__extension__", "__restrict__", "__restrict", "__inline__", "__inline",
     "__asm__", "__asm",
@@ -97,7 +98,7 @@ ignore_type_keywords = [
     "WT_STAT_COMPR_RATIO_WRITE_HIST_INCR_FUNC", "WT_STAT_USECS_HIST_INCR_FUNC",
     "WT_ATOMIC_CAS_FUNC", "WT_ATOMIC_FUNC", "WT_CURDUMP_PASS",
     "WT_STAT_MSECS_HIST_INCR_FUNC",
-    ]
+    ])
 
 c_ops_all = (
     "<<=", ">>=",
@@ -112,8 +113,17 @@ c_ops_all = (
 reg_member_access = regex.compile(r"^\.|->", re_flags)
 
 def file_content(fname: str) -> str:
-    with open(fname) as file:
-        return file.read()
+    """Same as open(fname).read() but decoded straight from a read-only mapping of the file"""
+    encoding = locale.getpreferredencoding(False)
+    with open(fname, "rb") as file:
+        try:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                txt = str(mm, encoding)
+        except (ValueError, OSError):  # Empty files and pipes can't be mapped
+            txt = str(file.read(), encoding)
+    if "\r" in txt:  # Universal newlines like in text mode
+        txt = txt.replace("\r\n", "\n").replace("\r", "\n")
+    return txt
 
 
 reg_word_char = regex.compile(r"\w", re_flags)
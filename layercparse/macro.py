@@ -11,6 +11,7 @@ from .workspace import *
 reg_define = regex.compile(
     r"^\#define\s++(?P<name>\w++)(?P<args>\((?P<args_in>[^)]*+)\))?\s*+(?P<body>.*)$", re_flags)
 reg_whole_word = regex.compile(r"[\w\.]++", re_flags)
+_reg_digit = regex.compile(r"\d")
 
 # The difference from re_token is that # and ## are operators rather than preprocessor directives
 re_token_preproc = r'''(?(DEFINE)(?<TOKEN>
@@ -37,14 +38,11 @@ re_token_preproc = r'''(?(DEFINE)(?<TOKEN>
 ))''' # /nxs;
 
 reg_token_preproc = regex.compile(r"(?&TOKEN)"+re_token_preproc, re_flags)
+# Matches a text that consists entirely of tokens
+reg_wellformed = regex.compile(r"(?&TOKEN)*+"+re_token_preproc, re_flags)
 
 def is_wellformed(txt: str) -> bool:
-    offset = 0
-    for match in reg_token_preproc.finditer(txt):
-        if match.start() != offset:
-            return False
-        offset = match.end()
-    return offset == len(txt)
+    return reg_wellformed.fullmatch(txt) is not None
 
 def get_unbalanced(txt: str) -> list[str]:
     ret: list[str] = []
@@ -65,11 +63,19 @@ _re_clean_preproc = r'''(
 )''' # /nxs;
 _reg_clean_preproc = regex.compile(_re_clean_preproc, re_flags)
 
+# Only comments match, strings are skipped
+_re_clean_preproc_skip = r'''
+    (?> (?> " (?>[^\\"]|\\.)* " ) | (?> ' (?>[^\\']|\\.)* ' ) ) (*SKIP)(*FAIL) |
+    (?>(?> \/\/ (?:[^\\\n]|\\.)*+ \n) |
+    (?> \/\* (?:[^*]|\*[^\/])*+ \*\/ ))++
+''' # /nxs;
+_reg_clean_preproc_skip = regex.compile(_re_clean_preproc_skip, re_flags)
+
 # Remove comments for preprocessor
 def _clean_text_preproc(txt: str):
-    return _reg_clean_preproc.sub(lambda match: reg_cr.sub(" ", match[0]) if match["s"] else match[0], txt)
+    return _reg_clean_preproc_skip.sub(lambda match: reg_cr.sub(" ", match[0]), txt)
 
-@dataclass
+@dataclass(slots=True)
 class MacroParts:
     name: Token
     args: list[Token] | None = None
@@ -84,6 +90,8 @@ class MacroParts:
     unbalanced: str | None = None
     has_rettype: bool | None = None
     typename: TokenList = field(default_factory=TokenList)
+    # Whether the body has any # or ## operators or argument references, filled in on first expansion
+    has_arg_subst: bool | None = field(default=None, repr=False, compare=False)
 
     # TODO(later): Parse body into a list of tokens.
     #              Use special token types for # and ## operators and replacements
@@ -136,10 +144,11 @@ class MacroParts:
     def fromStatement(statement: Statement) -> 'MacroParts | None':
         preComment = None
         for token in statement.tokens:
-            if not preComment and token.getKind() == "/":
+            kind = token.getKind()
+            if not preComment and kind == "/":
                 preComment = token
                 continue
-            if token.getKind() in [" ", "/"]:
+            if kind in (" ", "/"):
                 continue
             if match := reg_define.match(token.value):
                 break
@@ -186,13 +195,14 @@ class MacroParts:
             offset = match.end()
             if not unbalanced:  # Only add tokens up to the first unbalanced token after which the expression is broken
                 token = Token.fromMatch(match, self.body.range[0])
-                if token.getKind() not in [" ", "/", ";"]:
+                kind = token.getKind()
+                if kind not in (" ", "/", ";"):
                     tokens.append(token)
                     if self.is_const is None:
-                        if (token.getKind() == "'" or
-                                (token.getKind() == "w" and regex.match(r"^\d", token.value))):
+                        if (kind == "'" or
+                                (kind == "w" and _reg_digit.match(token.value))):
                             self.is_const = True
-                        elif token.getKind() == "+":
+                        elif kind == "+":
                             pass  # skip operators
                         else:
                             self.is_const = False
@@ -226,7 +236,8 @@ class MacroParts:
             return self.typename
 
         # fist token is something in (...)
-        if tokens[1].getKind() not in ["w", "(", "{"] or (tokens[1].getKind() == "+" and tokens[1].value != "*"):
+        kind = tokens[1].getKind()
+        if kind not in ("w", "(", "{") or (kind == "+" and tokens[1].value != "*"):
             return self.typename
 
         return self._get_preproc_tokens_from_text(tokens[0].value[1:-1], base_offset+1)
@@ -239,7 +250,7 @@ class MacroParts:
                 break
             offset = match.end()
             token = Token.fromMatch(match, self.body.range[0])  # type: ignore[union-attr] # we do have a body
-            if token.getKind() not in [" ", "/", ";"]:
+            if token.getKind() not in (" ", "/", ";"):
                 tokens.append(token)
         return tokens
 
@@ -1,14 +1,32 @@
+import itertools
 from dataclasses import dataclass
 
 from .workspace import *
 from .macro import *
 
+try:
+    import ahocorasick  # type: ignore[import-not-found] # Optional: pip install layercparse[fast]
+except ImportError:
+    ahocorasick = None
+
 def c_string_escape(txt: str) -> str:
     return txt.replace("\\", "\\\\").replace("\n", "\\n").replace("\t", "\\t").replace("\"", "\\\"")
 
 def _D2M(val: 'Definition') -> MacroParts: # type: ignore[name-defined] # circular dependency for Definition
     return cast(MacroParts, val.details)
 
+# Argument substitution regex, by the macro argument names
+_reg_macro_subst_cache: dict[tuple[str, ...], regex.Pattern] = {}
+
+def _get_reg_macro_subst(names: tuple[str, ...]) -> regex.Pattern:
+    if (reg := _reg_macro_subst_cache.get(names)) is None:
+        reg = _reg_macro_subst_cache[names] = regex.compile(r"""
+            (?P<h> \#\s*+ (?P<n>\w++) ) |
+            (?P<hh> (?P<n>\w++)(?>\s*+(\#\#)\s*+(?P<n>\w++))++) |
+            (?P<n>\b(?:\L<names>)\b)
+        """, re_flags, names=names)
+    return reg
+
 # @dataclass
 # class ExpandTree:
 #     expansionTree: 'map[str, ExpandTree]'
@@ -25,8 +43,6 @@ class MacroExpander:
     #  - https://stackoverflow.com/questions/45375238/c-preprocessor-macro-expansion
     #  - https://gcc.gnu.org/onlinedocs/cpp/Argument-Prescan.html
     def expand(self, txt: str, macros: 'dict[str, Definition]', expand_const: bool = False) -> str: # type: ignore[name-defined] # circular dependency for Definition
-        # TODO(later): Optimise: compose the result as a list of strings, then join at the end
-
         self.insert_list = []  # (offset, delta)
         self.expand_list = []
         if not macros:
@@ -55,6 +71,13 @@ class MacroExpander:
             kwargs["names_obj"] = obj_like_names
             names_re_a.append(r"""(?P<name> \b(?:\L<names_obj>)\b )""")
             self._has_obj_like_names = True
+        self._names_automaton = None
+        if ahocorasick is not None and (obj_like_names or fn_like_names):
+            # Linear scan for any of the names to skip fragments that can't have expansions
+            self._names_automaton = ahocorasick.Automaton()
+            for k in itertools.chain(obj_like_names, fn_like_names):
+                self._names_automaton.add_word(k, k)
+            self._names_automaton.make_automaton()
         if fn_like_names:
             kwargs["names_func"] = fn_like_names
             names_re_a.append(r"""
@@ -67,33 +90,42 @@ class MacroExpander:
             return txt
 
         self._names_reg = regex.compile(" | ".join(names_re_a), re_flags, **kwargs)  # type: ignore # **kwargs
-        self._recurse_in_use: set[str] = set()  # recursion control
-        self._owner_stack: list[str] = []       # stack of current expansion "owning" scopes
+        # Recursion control and the stack of current expansion "owning" scopes in one:
+        # insertion order of the keys is the stack order, the last key is the current owner
+        self._in_use: dict[str, int] = {}
         self._expanding_stack: list[str] = []   # stack of current expansion levels
         self._expand_offset = 0
+        # Expansion results by (name, args text, names in use) -> (replacement, expansions)
+        self._expand_cache: dict[tuple, tuple[str, tuple[tuple[str | None, str], ...]]] = {}
+        self._expand_log: list[tuple[str, str]] = []  # (owner, name) entered since the top level
 
-        # The difference between _owner_stack and _expanding_stack is best demonstrated by the
+        # The difference between _in_use and _expanding_stack is best demonstrated by the
         # following example. Consider the following code:
         #
         #     CAT(HE, LLO)
         #
         # The topmost expansion matches the entire macro "CAT(HE, LLO)" and _expanding_stack is
-        # entered into "CAT". The _owner_stack is empty because expansion of its arguments "HE" and
+        # entered into "CAT". The _in_use is empty because expansion of its arguments "HE" and
         # "LLO" are performed on the topmost level, not within the "CAT" macro.
-        # Then, when the contents of "CAT" are expanded with arguments substituted, the _owner_stack
+        # Then, when the contents of "CAT" are expanded with arguments substituted, the _in_use
         # is set to "CAT" as well.
 
         ret = self._expand_fragment(txt)
-        del self._macros, self._cur_expand_entry # delete temporaries
+        del self._macros, self._cur_expand_entry, self._expand_cache, self._expand_log # delete temporaries
+        del self._names_automaton
         return ret
 
+    def __owner(self) -> str:
+        return next(reversed(self._in_use), "")
+
     def __expand_enter(self, name: str) -> None:
         self._expanding_stack.append(name)
-        parent = self._owner_stack[-1] if self._owner_stack else ""
+        parent = self.__owner()
         if parent not in self._cur_expand_entry:
             self._cur_expand_entry[parent] = set()
         self._cur_expand_entry[parent].add(name)
-        DEBUG4(None, lambda: f"Expanding macro {' => '.join(self._owner_stack)} => {name}")
+        self._expand_log.append((parent, name))
+        DEBUG4(None, lambda: f"Expanding macro {' => '.join(self._in_use)} => {name}")
 
     def __expand_leave(self, replacement: str, match: regex.Match, base_offset) -> str:
         DEBUG5(None, f"Macro expand {self._expanding_stack}: <<<{replacement}>>>")
@@ -107,43 +139,85 @@ class MacroExpander:
             self.expand_list.append(Expansions(ins, self._cur_expand_entry))
             self._expand_offset += delta
             self._cur_expand_entry = {}
+            self._expand_log = []
         return replacement
 
+    def __recorded_expansions(self, start: int) -> tuple[tuple[str | None, str], ...]:
+        """Expansions entered since _expand_log[start], relative to the current owner (None)"""
+        owner = self.__owner()
+        return tuple((None if parent == owner else parent, name)
+                     for parent, name in self._expand_log[start:])
+
+    def __replay_expansions(self, expansions: tuple[tuple[str | None, str], ...]) -> None:
+        """Repeat the expansion bookkeeping of a cached result at the current owner"""
+        owner = self.__owner()
+        for parent, name in expansions:
+            if parent is None:
+                parent = owner
+            if parent not in self._cur_expand_entry:
+                self._cur_expand_entry[parent] = set()
+            self._cur_expand_entry[parent].add(name)
+            self._expand_log.append((parent, name))
+
     def _expand_fragment(self, txt: str, base_offset: int = 0) -> str:
-        return self._names_reg.sub(
-            lambda match: self._expand_fn_like(match, base_offset + base_offset) \
-                                if self._has_fn_like_names and match["args"] else \
-                          self._expand_obj_like(match, base_offset + base_offset) \
-                                if self._has_obj_like_names and match["name"] else \
-                          match[0],
-            txt)
+        if self._names_automaton is not None and next(self._names_automaton.iter(txt), None) is None:
+            return txt  # No macro names in the text
+        # Compose the result as a list of strings, then join at the end
+        out: list[str] = []
+        pos = 0
+        scanner = self._names_reg.scanner(txt)
+        for match in iter(scanner.search, None):
+            out.append(txt[pos:match.start()])
+            out.append(self._expand_fn_like(match, base_offset + base_offset) \
+                            if self._has_fn_like_names and match["args"] else \
+                       self._expand_obj_like(match, base_offset + base_offset) \
+                            if self._has_obj_like_names and match["name"] else \
+                       match[0])
+            pos = match.end()
+        if not pos:
+            return txt  # Nothing matched
+        out.append(txt[pos:])
+        return "".join(out)
 
     def _expand_obj_like(self, match: regex.Match, base_offset: int = 0) -> str:
         name = match["name"]
         self.__expand_enter(name)
-        if name in self._recurse_in_use:
+        if name in self._in_use:
             return self.__expand_leave(match[0], match, base_offset)
         if not _D2M(self._macros[name]).body:
             return self.__expand_leave("", match, base_offset)
 
-        self._recurse_in_use.add(name)
-        self._owner_stack.append(name)
+        # The result only depends on which macros are blocked from recursive expansion
+        key = (name, None, frozenset(self._in_use))
+        if (cached := self._expand_cache.get(key)) is not None:
+            self.__replay_expansions(cached[1])
+            return self.__expand_leave(cached[0], match, base_offset)
+        start = len(self._expand_log)
+
+        self._in_use[name] = 1
         # TODO: push scope
         replacement = self._expand_fragment(_D2M(self._macros[name]).body.value, base_offset)  # type: ignore # match is not None
-        self._owner_stack.pop()
-        self._recurse_in_use.remove(name)
+        del self._in_use[name]
 
+        self._expand_cache[key] = (replacement, self.__recorded_expansions(start))
         return self.__expand_leave(replacement, match, base_offset)
 
     def _expand_fn_like(self, match: regex.Match, base_offset: int = 0) -> str:
         name = match["name"]
         self.__expand_enter(name)
-        if name in self._recurse_in_use:
+        if name in self._in_use:
             return self.__expand_leave(match[0], match, base_offset)
         macro = _D2M(self._macros[name])
         if not macro.body:
             return self.__expand_leave("", match, base_offset)
 
+        # The result only depends on the arguments and which macros are blocked from recursion
+        key = (name, match["list"], frozenset(self._in_use))
+        if (cached := self._expand_cache.get(key)) is not None:
+            self.__replay_expansions(cached[1])
+            return self.__expand_leave(cached[0], match, base_offset)
+        start = len(self._expand_log)
+
         # Parse args
         args_val: list[TokenList] = [TokenList([])]
         for token_arg in TokenList.xFromText(match["list"],
@@ -177,11 +251,9 @@ class MacroExpander:
 
             # Replace operators # and ## and arguments
             # TODO: protect from expanding in comments and strings
-            reg_macro_subst = regex.compile(r"""
-                (?P<h> \#\s*+ (?P<n>\w++) ) |
-                (?P<hh> (?P<n>\w++)(?>\s*+(\#\#)\s*+(?P<n>\w++))++) |
-                (?P<n>\b(?:\L<names>)\b)
-            """, re_flags, names=args_dict.keys())
+            reg_macro_subst = _get_reg_macro_subst(tuple(args_dict.keys()))
+            if macro.has_arg_subst is None:
+                macro.has_arg_subst = reg_macro_subst.search(replacement) is not None
 
             def _concat_hh(match: regex.Match) -> str:
                 return "".join(((args_dict[name].value if name in args_dict else name) \
@@ -189,17 +261,18 @@ class MacroExpander:
             def _arg_c_escape(name: str) -> str:
                 return '"'+c_string_escape(args_dict[name].value)+'"' if name in args_dict else '""'
 
-            replacement = reg_macro_subst.sub(
-                lambda match: _arg_c_escape(match["n"]) if match["h"] else \
-                              _concat_hh(match) if match["hh"] else \
-                              args_dict_expanded[match["n"]].value,
-                replacement)
+            # Wrapper macros that don't use their args in the body don't need the substitution pass
+            if macro.has_arg_subst:
+                replacement = reg_macro_subst.sub(
+                    lambda match: _arg_c_escape(match["n"]) if match["h"] else \
+                                  _concat_hh(match) if match["hh"] else \
+                                  args_dict_expanded[match["n"]].value,
+                    replacement)
 
         # Another round of global replacement
-        self._recurse_in_use.add(name)
-        self._owner_stack.append(name)
+        self._in_use[name] = 1
         replacement = self._expand_fragment(replacement, base_offset+match.start())
-        self._owner_stack.pop()
-        self._recurse_in_use.remove(name)
+        del self._in_use[name]
 
+        self._expand_cache[key] = (replacement, self.__recorded_expansions(start))
         return self.__expand_leave(replacement, match, base_offset)
@@ -646,6 +646,8 @@ def scan_sources_main(extraFiles: list[str], modules: list[Module], extraMacros:
     if _args.clear_cache:
         cache.clearcache()
     cache.use_cache = _args.cache
+    if cache.use_cache:
+        cache.prime_stat_cache(files + _script_files)
     _args.cache = _args.clear_cache = None  # Clear for proper cache key
 
     _globals = load_globals(files, extraMacros)
@@ -1,23 +1,28 @@
 import enum
+import itertools
 from itertools import islice
 from dataclasses import dataclass
 from typing import Iterable
 
 from .ctoken import *
 
-def clean_tokens_decl(clean_tokens: TokenList, clean_static_const: bool = True) -> TokenList:
-    """Clean tokens for variable declaration detection"""
-    i = 0
-    while i < len(clean_tokens):
-        if clean_tokens[i].value in ignore_type_keywords:
-            clean_tokens.pop(i)
-            if i < len(clean_tokens) and clean_tokens[i].getKind() == "(":
-                clean_tokens.pop(i)
-        elif clean_static_const and clean_tokens[i].value in ["const", "static"]:
-            clean_tokens.pop(i)
-        else:
-            i += 1
-    return clean_tokens
+_kinds_space_comment: frozenset[TokenKind] = frozenset((" ", "/"))
+_kinds_space_comment_preproc: frozenset[TokenKind] = frozenset((" ", "#", "/"))
+
+def clean_tokens_decl(clean_tokens: Iterable[Token], clean_static_const: bool = True) -> TokenList:
+    """Clean tokens for variable declaration detection. Returns a new list."""
+    ret = TokenList()
+    skip_args = False  # Skip the () following an ignored keyword
+    for token in clean_tokens:
+        if skip_args:
+            skip_args = False
+            if token.getKind() == "(":
+                continue
+        if token.value in ignore_type_keywords:
+            skip_args = True
+        elif not clean_static_const or token.value not in ("const", "static"):
+            ret.append(token)
+    return ret
 
 def scan_defn_ctype(clean_tokens: TokenList, ignore_static_const: bool = True) -> tuple[TokenList, int, Token | None]:
     """Scan for type of a C declaration. clean_tokens should be treated with filterCode and clean_tokens_decl."""
@@ -96,26 +101,27 @@ class StatementKind:
         if not tokens:
             return ret
         for token in tokens:
-            if token.getKind() == " ":
+            kind = token.getKind()
+            if kind == " ":
                 continue
-            if token.getKind() == "/":
+            if kind == "/":
                 ret.is_comment = True
                 ret.preComment = token
                 continue
-            if token.getKind() == "#":
+            if kind == "#":
                 ret.is_preproc = True
                 return ret
             if token.value in c_statement_keywords:
                 ret.is_statement = True
                 return ret
-            if token.getKind() not in [" ", "#", "/"]:
+            if kind not in _kinds_space_comment_preproc:
                 break
         else:
             # we get here if "break" was not executed
             return ret
 
         # Only get here if we have a non-empty token
-        clean_tokens = clean_tokens_decl(tokens.filterCode())
+        clean_tokens = clean_tokens_decl(tokens.xFilterCode())
 
         if not clean_tokens:
             return ret
@@ -276,13 +282,15 @@ class StatementList(list[Statement]):
 
     @staticmethod
     def xFromText(txt: str, base_offset: int, **kwargs) -> Iterable[Statement]:
-        return StatementList.xFromTokens(TokenList.fromText(txt, base_offset=base_offset, **kwargs))
+        # Tokenize only as far as the statements are consumed
+        return StatementList.xFromTokens(
+            TokenStream(TokenList.xFromText(txt, base_offset=base_offset, **kwargs)))
     @staticmethod
     def fromText(txt: str, base_offset: int, **kwargs) -> 'StatementList':
         return StatementList.fromTokens(TokenList.fromText(txt, base_offset=base_offset, **kwargs))
 
     @staticmethod
-    def xFromTokens(tokens: TokenList) -> Iterable[Statement]:
+    def xFromTokens(tokens: TokenList | TokenStream) -> Iterable[Statement]:
         cur, complete, statement_special, curly, comment_only, is_record, is_expr = \
             TokenList([]), False, 0, False, None, False, False
         else_idx = -1
@@ -294,37 +302,42 @@ class StatementList(list[Statement]):
                 TokenList([]), False, 0, False, None, False, False
             return ret
 
-        for i in range(len(tokens)):
-            def find_else():
-                nonlocal else_idx, i
-                if else_idx > i:
-                    return tokens[else_idx].value == "else"
-                for ii in range(i+1, len(tokens)):
-                    if tokens[ii].value == "else":
-                        else_idx = ii
-                        return True
-                    if (tokens[ii].value.startswith(";") or
-                            tokens[ii].getKind() not in [" ", "#", "/"]):
-                        else_idx = ii
-                        return False
-
-            token = tokens[i]
-
-            if token.getKind() == "@":  # invalid token
+        i = 0
+        def find_else():
+            nonlocal else_idx, i
+            if else_idx > i:
+                return tokens[else_idx].value == "else"
+            for ii in itertools.count(i+1):
+                try:
+                    token = tokens[ii]
+                except IndexError:
+                    return None
+                if token.value == "else":
+                    else_idx = ii
+                    return True
+                if (token.value == ";" or
+                        token.getKind() not in _kinds_space_comment_preproc):
+                    else_idx = ii
+                    return False
+
+        for i, token in enumerate(tokens):
+            kind = token.getKind()
+
+            if kind == "@":  # invalid token
                 if cur:
                     yield push_statement()
                 yield Statement(TokenList([token]))
                 continue
 
-            if (complete and token.getKind() not in [" ", "/"]) or \
-               (comment_only and token.getKind() == "/"):
+            if (complete and kind not in _kinds_space_comment) or \
+               (comment_only and kind == "/"):
                     yield push_statement()
 
-            if comment_only is None and token.getKind() == "/":
+            if comment_only is None and kind == "/":
                 comment_only = True
-            elif comment_only is not False and token.getKind() not in [" ", "/"]:
+            elif comment_only is not False and kind not in _kinds_space_comment:
                 comment_only = False
-            if not is_expr and token.getKind() == "+" and token.value != "*":
+            if not is_expr and kind == "+" and token.value != "*":
                 is_expr = True
 
             if not statement_special:   # Constructs that don't end by ; or {}
@@ -340,17 +353,17 @@ class StatementList(list[Statement]):
 
             cur.append(token)
 
-            if (complete and token.value == "\n") or token.getKind() == "#":
+            if (complete and token.value == "\n") or kind == "#":
                 # preproc is always a single token
                 yield push_statement()
                 continue
 
-            if token.value[0] not in [";", ",", "{"]:  # Any statement ends with one of these
+            if kind != ";" and kind != "{":  # Any statement ends with one of ; , {}
                 continue
 
-            if token.value.startswith("{"):
+            if kind == "{":
                 curly = True
-            elif token.value in [";", ","] and statement_special == 2:
+            elif statement_special == 2:  # ; or ,
                 if is_record and not curly:
                     is_record = False
                     statement_special = 0
@@ -358,7 +371,7 @@ class StatementList(list[Statement]):
             if statement_special == 1:
                 if find_else():
                     continue
-            elif statement_special == 2 and token.value[0] != ";":
+            elif statement_special == 2 and token.value != ";":
                 continue
 
             # The statement is complete but may want to attach trailing \n or comments
@@ -403,6 +416,5 @@ class StatementList(list[Statement]):
 
     @staticmethod
     def preprocFromFile(fname: str) -> Iterable[Statement]:
-        with open(fname) as file:
-            return StatementList.preprocFromText(file.read())
+        return StatementList.preprocFromText(file_content(fname))
 
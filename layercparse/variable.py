@@ -6,14 +6,14 @@ from .ctoken import *
 from .statement import clean_tokens_decl, scan_defn_ctype
 from .workspace import scope, Scope
 
+_reg_non_word = regex.compile(r"\W+")
+
 def get_base_type(clean_tokens: TokenList) -> str:
-    type = TokenList((filter(lambda x:
-                x.value not in c_type_keywords and x.value != "*", clean_tokens)))
+    type = [token for token in clean_tokens if token.value not in c_type_keywords and token.value != "*"]
     return type[-1].value if type else ""
 
 def get_base_type_str(clean_txt: str, **kwargs) -> str:
-    return get_base_type(TokenList(TokenList.xxFilterCode(TokenList.xFromText(
-                clean_txt, base_offset=0, **kwargs))))
+    return get_base_type(TokenList.fromTextCode(clean_txt, base_offset=0, **kwargs))
 
 @dataclass
 class Variable:
@@ -76,7 +76,7 @@ class Variable:
             return None
 
         name = deepcopy(clean_tokens.pop())
-        name.value = regex.sub(r"\W+", "", name.value)
+        name.value = _reg_non_word.sub("", name.value)
         # if clean_tokens[-1].getKind() == "(": # Function pointer
         #     # TODO: Work-around this:
         #     # uint32_t (*wiredtiger_crc32c_func(void))(const void *, size_t)
@@ -95,8 +95,8 @@ class Variable:
         #     name.value = regex.sub(r"\W+", "", name.value)
 
         # Remove C keywords from type
-        type = TokenList((filter(lambda x:
-                    x.value not in c_type_keywords and x.value != "*", clean_tokens)))
+        type = TokenList([token for token in clean_tokens
+                          if token.value not in c_type_keywords and token.value != "*"])
 
         end = None
         for token in reversed(vardef):
@@ -112,7 +112,15 @@ class Variable:
     def fromFuncArg(vardef: TokenList) -> 'Variable | None':
         """Get the variable name and type from C declaration."""
 
-        clean_tokens = clean_tokens_decl(vardef.filterCode())
+        clean_tokens = clean_tokens_decl(vardef.xFilterCode())
+
+        # Most arguments are a plain "type name"
+        if (len(clean_tokens) == 2 and
+                clean_tokens[0].getKind() == "w" and clean_tokens[1].getKind() == "w" and
+                clean_tokens[0].value not in c_type_keywords and
+                clean_tokens[1].value not in c_type_keywords and
+                clean_tokens[1].value not in c_types):
+            return Variable(clean_tokens[1], TokenList([clean_tokens[0]]))
 
         type, i, token = scan_defn_ctype(clean_tokens)
 
@@ -133,9 +141,8 @@ class Variable:
             if token.getKind() == "(":
                 for token in reversed(
                         clean_tokens_decl(
-                            TokenList(TokenList.xxFilterCode(
-                                TokenList.xFromText(
-                                    token.value[1:-1], base_offset=token.range[0]))))):
+                            TokenList.xFromTextCode(
+                                token.value[1:-1], base_offset=token.range[0]))):
                     if token.getKind() == "w":
                         return Variable(token, type)
                 break
@@ -82,6 +82,8 @@ def setModules(mods: Iterable[Module]):
             moduleAliasesSrc[alias] = name
     moduleSrcNames = set(modules.keys()).union(set(moduleAliasesSrc.keys()))
 
+_reg_module_desc = regex.compile(r"<!--\s*+MODULE:\s*+((?&TOKEN))\s*+-->"+re_token, re_flags)
+
 # Read module description from a file
 # src/<name>/README.md
 # <!-- MODULE: {
@@ -99,8 +101,7 @@ def read_module_desc(name: str = "", fname = "", **kwargs) -> Iterable[Module]:
             return
     with open(fname) as file:
         txt = file.read()
-    for match in regex.finditer(r"<!--\s*+MODULE:\s*+((?&TOKEN))\s*+-->"+re_token,
-                                txt, flags=re_flags):
+    for match in _reg_module_desc.finditer(txt):
         try:
             desc = {"name": name, **kwargs, **json.loads(clean_text(match[1]))}
         except json.JSONDecodeError as e:
@@ -171,6 +172,8 @@ def fname_to_module(fname: str) -> str:
     return ""
 
 
+_reg_newline = regex.compile(r"\n")
+
 @dataclass
 class File:
     name: str
@@ -200,7 +203,7 @@ class File:
     def fillLineInfo(self, txt: str) -> list[int]:
         if self.lineOffsets is None:
             self.lineOffsets = []
-            for match in regex.finditer(r"\n", txt):
+            for match in _reg_newline.finditer(txt):
                 self.lineOffsets.append(match.start())
         return self.lineOffsets
 
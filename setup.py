@@ -21,4 +21,5 @@ setup(
     # scripts=["bin/..."],
     packages=["layercparse"],
     install_requires = requirements,
+    extras_require = {"fast": ["pyahocorasick"]},  # Prefilter for macro expansion
     zip_safe=False)
@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 
-import sys, os
+import sys, os, tempfile, pickle
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 os.chdir(os.path.dirname(__file__))
 
 import unittest
+import unittest.mock
 from unittest.util import _common_shorten_repr
 from copy import deepcopy
 
 from layercparse import *
+from layercparse import macroexpand, cache
 from pprint import pprint, pformat
 from io import StringIO
 
@@ -149,10 +151,77 @@ class TestRegex(TestCaseLocal):
                          "qwe 'QQQ  /* WWW */ ' asd wer")
 
 
+class TestFileContent(TestCaseLocal):
+    def checkContent(self, data: bytes, expected: str):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, "a.c")
+            with open(fname, "wb") as f:
+                f.write(data)
+            self.assertEqual(file_content(fname), expected)
+            with open(fname) as f:
+                self.assertEqual(file_content(fname), f.read())
+
+    def test_crlf(self):
+        self.checkContent(b"int a;\r\nint b;\r\n", "int a;\nint b;\n")
+
+    def test_cr(self):
+        self.checkContent(b"int a;\rint b;\r", "int a;\nint b;\n")
+
+    def test_empty(self):
+        self.checkContent(b"", "")
+
+    @unittest.skipUnless(os.path.isdir("/dev/fd"), "needs /dev/fd")
+    def test_pipe(self):
+        r, w = os.pipe()
+        try:
+            os.write(w, b"int a;\r\n")
+            os.close(w)
+            self.assertEqual(file_content(f"/dev/fd/{r}"), "int a;\n")
+        finally:
+            os.close(r)
+
+
 class TestToken(TestCaseLocal):
     def test_token(self):
         self.checkObjAgainstFile(TokenList.fromFile("data/block.h"), "data/block.h.tokens")
 
+    def test_token_files(self):
+        fnames = ["data/block.h", "data/func_simple.c"]
+        for multithread in (True, False):
+            with self.subTest(multithread=multithread):
+                tokens = TokenList.fromFiles(fnames, multithread=multithread)
+                self.assertEqual(list(tokens), fnames)
+                self.checkObjAgainstFile(tokens["data/block.h"], "data/block.h.tokens")
+                for fname in fnames:
+                    self.assertEqual([(t.idx, t.range, t.value) for t in tokens[fname]],
+                                     [(t.idx, t.range, t.value) for t in TokenList.fromFile(fname)])
+
+    def test_token_file_changed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, "a.c")
+            with open(fname, "w") as f:
+                f.write("int a;")
+            tokens = TokenList.fromFile(fname)
+            tokens[0].value = "char"
+            self.assertEqual("".join(TokenList.fromFile(fname).strings()), "int a;")
+            st = os.stat(fname)
+            with open(fname, "w") as f:
+                f.write("int bb;")
+            self.assertEqual("".join(TokenList.fromFile(fname).strings()), "int bb;")
+            # Same size and mtime can't be told apart without evict()
+            with open(fname, "w") as f:
+                f.write("int cc;")
+            os.utime(fname, ns=(st.st_atime_ns, os.stat(fname).st_mtime_ns))
+            TokenList.evict(fname)
+            self.assertEqual("".join(TokenList.fromFile(fname).strings()), "int cc;")
+
+    def test_pre_comment(self):
+        self.assertEqual(get_pre_comment(TokenList()), (None, 0))
+        self.assertEqual(get_pre_comment(TokenList.fromText("  ", 0)), (None, 1))
+        self.assertEqual(get_pre_comment(TokenList.fromText("  int a;", 0)), (None, 1))
+        comment, i = get_pre_comment(TokenList.fromText("\n/* c */\nint a;", 0))
+        self.assertEqual((comment.value if comment else None, i), ("/* c */", 2))
+
 
 class TestVariable(TestCaseLocal):
     def test_1(self):
@@ -198,6 +267,14 @@ class TestFuncArgs(TestCaseLocal):
             repr(Variable.fromFuncArg(TokenList.fromText("int *a[10],", 0))),
             r"""Variable(name=Token(idx=3, range=(5, 6), value='a'), typename=[0:3] 〈int〉, """
             r"""preComment=None, postComment=None, end=None)""")
+    def test_preprocessor(self):
+        # Preprocessor lines don't split arguments, only commas do
+        func = FunctionParts.fromStatement(StatementList.fromText("void f(int\n#ifdef X\n a) {}", 0)[0])
+        self.assertIsNotNone(func)
+        self.assertMultiLineEqualDiff(
+            repr(func.getArgs() if func else None),
+            r"""[Variable(name=Token(idx=4, range=(21, 22), value='a'), typename=[7:10] 〈int〉, """
+            r"""preComment=None, postComment=None, end=None)]""")
 
 
 class TestStatement(TestCaseLocal):
@@ -276,6 +353,22 @@ class TestMacro(TestCaseLocal):
             self.checkStrAgainstFile(_sort_set_txt(pf(expander.expand_list)),
                                     "data/macro.c.macro-noconst-expands")
 
+    @unittest.skipUnless(macroexpand.ahocorasick, "needs pyahocorasick")
+    def test_macro_prefilter(self):
+        # Expansion must be the same with and without the optional name prefilter
+        _globals = Codebase()
+        with ScopePush(file=File("data/macro.c")):
+            src = scope_file().read()
+            for p in StatementList.preprocFromText(src):
+                _globals.addMacroDesc(MacroParts.fromStatement(p))
+            results = []
+            for prefilter in (macroexpand.ahocorasick, None):
+                with unittest.mock.patch.object(macroexpand, "ahocorasick", prefilter):
+                    expander = MacroExpander()
+                    expanded = expander.expand(src, _globals.macros, expand_const=True)
+                    results.append((expanded, pf(expander.insert_list), pf(expander.expand_list)))
+            self.assertEqual(results[0], results[1])
+
     def test_macro_expand(self):
         setModules([Module("mod1"), Module("mod2")])
 
@@ -308,6 +401,63 @@ class TestMacro(TestCaseLocal):
 
         workspace.logStream = None
 
+class TestCache(TestCaseLocal):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.rootPath = workspace.rootPath
+        workspace.rootPath = self.tmpdir.name
+        self.src = os.path.join(self.tmpdir.name, "src.c")
+        with open(self.src, "w") as f:
+            f.write("int a;\n")
+        cache.put({"a": 1}, self.src)
+        self.cachepath = cache.getcachepath(self.src)
+
+    def tearDown(self):
+        workspace.rootPath = self.rootPath
+        self.tmpdir.cleanup()
+
+    def age(self, path, seconds):
+        st = os.stat(path)
+        os.utime(path, (st.st_atime - seconds, st.st_mtime - seconds))
+
+    def test_meta(self):
+        self.assertTrue(os.path.isfile(self.cachepath + ".meta"))
+        self.assertEqual(cache.get(self.src), {"a": 1})
+
+    def test_hash_match(self):
+        self.age(self.cachepath, 100)
+        self.age(self.src, 50)
+        cache_mtime = os.stat(self.cachepath).st_mtime
+        self.assertEqual(cache.get(self.src), {"a": 1})
+        self.assertGreater(os.stat(self.cachepath).st_mtime, cache_mtime)
+
+    def test_hash_match_read_only(self):
+        self.age(self.cachepath, 100)
+        self.age(self.src, 50)
+        with unittest.mock.patch.object(cache.os, "utime", side_effect=PermissionError):
+            self.assertEqual(cache.get(self.src), {"a": 1})
+
+    def test_put_unhashable(self):
+        # The new data must not be validated by the .meta of the previous put()
+        missing = os.path.join(self.tmpdir.name, "missing.h")
+        cache.put({"a": 2}, self.src, dependencies=[self.src, missing])
+        self.assertFalse(os.path.exists(self.cachepath + ".meta"))
+        self.age(self.cachepath, 100)
+        self.age(self.src, 50)
+        self.assertIsNone(cache.get(self.src))
+
+    def test_changed(self):
+        self.age(self.cachepath, 100)
+        with open(self.src, "w") as f:
+            f.write("int b;\n")
+        self.assertIsNone(cache.get(self.src))
+
+    def test_changed_within_slack(self):
+        with open(self.src, "w") as f:
+            f.write("int bb;\n")
+        self.assertIsNone(cache.get(self.src))
+
+
 class TestCodebase(TestCaseLocal):
     def test_codebase(self):
         _globals = Codebase()
@@ -317,6 +467,45 @@ class TestCodebase(TestCaseLocal):
         self.checkStrAgainstFile(pformat(_globals, width=120, compact=False),
                                  "data/statements.c.globals")
 
+    def test_codebase_multithread(self):
+        files = ["data/func_simple.c", "data/record.c", "data/statements.c", "data/various.c"]
+        def scan(multithread: bool) -> tuple[Codebase, str]:
+            workspace.logStream = StringIO()
+            _globals = Codebase()
+            _globals.scanFiles(files, twopass=True, multithread=multithread, jobs=2)
+            return _globals, workspace.logStream.getvalue()
+        def conflicts(log: str) -> list[str]:
+            return regex.split(r"^(?=.*conflicting update)", log, flags=regex.M)[1:]
+        logLevel = workspace.logLevel
+        setLogLevel(LogLevel.WARNING)
+        try:
+            serial, serial_log = scan(False)
+            multi, multi_log = scan(True)
+        finally:
+            setLogLevel(logLevel)
+            workspace.logStream = None
+        for d in ("names", "types"):
+            self.assertEqual({k: v.short_repr() for k, v in getattr(multi, d).items()},
+                             {k: v.short_repr() for k, v in getattr(serial, d).items()})
+        # Each definition is merged once: no repeated conflicts, all of them seen in a serial scan.
+        # Duplicates within a file are merged in the worker first, so the order may differ.
+        self.assertTrue(conflicts(multi_log))
+        self.assertEqual(len(set(conflicts(multi_log))), len(conflicts(multi_log)))
+        self.assertLessEqual(set(conflicts(multi_log)), set(conflicts(serial_log)))
+
+    def test_codebase_pickle(self):
+        _globals = Codebase()
+        _globals.scanFiles(["data/statements.c"], twopass=False, multithread=False)
+        loaded = pickle.loads(pickle.dumps(_globals, protocol=pickle.HIGHEST_PROTOCOL))
+        defns = list(loaded.names.values()) + list(loaded.types.values())
+        self.assertEqual([defn.short_repr() for defn in defns],
+                         [defn.short_repr() for defn in
+                          list(_globals.names.values()) + list(_globals.types.values())])
+        self.assertTrue(defns)
+        for defn in defns:
+            self.assertIs(defn.name, sys.intern(defn.name))
+            self.assertIs(defn.module, sys.intern(defn.module))
+
 
 # Enable to run as a standalone script
 if __name__ == "__main__":